@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Batch processing of many metro extracts: converts each OSM file to csv with
+the cleaning rules of its region (data.py), loads it into its own database
+(mapdb.py) and runs the report (report.py).
+
+Regions are scheduled largest first, one process per region, limited by
+the number of jobs and by an estimated memory budget. Every region writes
+only to its own csv directory and database. A failing region, a worker
+killed by the system or a region over the time limit is reported as failed
+and does not stop the batch.
+
+The manifest is a JSON list of regions, paths relative to the manifest:
+    [{"name": "boston", "osm": "boston_massachusetts.osm", "db": "BostonMA.db",
+      "rules": "boston_massachusetts.json", "csv_dir": "BostonMA_csv"}, ...]
+"rules" is looked up next to the manifest, then in the rules directory, and
+defaults to the Boston rules. Regions must not share a database or csv
+directory.
+
+The csv files are written to a new temporary directory next to the
+database and removed once the region is done. With --keep-csv they are
+written to "csv_dir" instead (default: the database path without extension
++ "_csv"), which is never removed.
+
+Usage: python batch.py manifest.json [--jobs N] [--memory-mb MB] [--timeout SECONDS]
+                                     [--output results.json] [--keep-csv] [--no-report]
+"""
+
+# Importing libraries
+import argparse
+import json
+import multiprocessing
+import os
+import Queue
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import cleaning
+import data
+import dbpool
+import mapdb
+import report
+
+
+# Rough peak memory of one region: a fixed base for the worker interpreter
+# and its modules, plus a share per byte of OSM input for the SQLite page
+# cache and memory map filling up with the database being built. Fitted
+# above the peaks measured on 1 to 100 MB synthetic extracts (21 MB to
+# 158 MB). Both caches are capped (dbpool.CACHE_SIZE, MMAP_SIZE), so the
+# estimate is conservative for very large extracts.
+MEMORY_BASE = 24 * 1024 * 1024
+MEMORY_PER_OSM_BYTE = 1.4
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def read_manifest(path):
+    '''Returns the regions of a manifest file with absolute paths.'''
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as manifest:
+        regions = json.load(manifest)
+
+    names = set()
+    dbs = set()
+    csv_dirs = []
+    for region in regions:
+        if region['name'] in names:
+            raise ValueError("Duplicate region name in manifest: {0}".format(region['name']))
+        names.add(region['name'])
+        region['osm'] = os.path.join(base, region['osm'])
+        region['db'] = os.path.realpath(os.path.join(base, region['db']))
+        if region['db'] in dbs:
+            raise ValueError("Duplicate database in manifest: {0}".format(region['db']))
+        dbs.add(region['db'])
+        rules = region.get('rules')
+        if rules is None:
+            region['rules'] = data.RULES_FILE
+        elif os.path.exists(os.path.join(base, rules)):
+            region['rules'] = os.path.join(base, rules)
+        else:
+            region['rules'] = os.path.join(cleaning.RULES_DIR, rules)
+
+        csv_dir = region.get('csv_dir')
+        if csv_dir is None:
+            region['csv_dir'] = os.path.splitext(region['db'])[0] + '_csv'
+        else:
+            region['csv_dir'] = os.path.realpath(os.path.join(base, csv_dir))
+        for other in csv_dirs:
+            if (region['csv_dir'] + os.sep).startswith(other + os.sep) or \
+               (other + os.sep).startswith(region['csv_dir'] + os.sep):
+                raise ValueError("Overlapping csv directories in manifest: {0} and {1}".format(
+                    other, region['csv_dir']))
+        csv_dirs.append(region['csv_dir'])
+    return regions
+
+def estimate_memory(region):
+    '''Returns the estimated peak memory of a region in bytes, from the size of its OSM file.'''
+    try:
+        return MEMORY_BASE + int(os.path.getsize(region['osm']) * MEMORY_PER_OSM_BYTE)
+    except OSError:
+        return MEMORY_BASE
+
+def remove_database(db_path):
+    '''Removes a previous database of the region with its WAL files and report cache.'''
+    for path in (db_path, db_path + '-wal', db_path + '-shm', db_path + '.report.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ================================================== #
+#               Region Worker                        #
+# ================================================== #
+def process_region(region, csv_dir, run_report=True):
+    '''Converts one region to csv files in csv_dir, loads and reports it. Runs in a
+    worker process and returns its timings, or the error if a stage failed.'''
+    result = {'name': region['name'], 'status': 'ok', 'stages': {}}
+    stages = result['stages']
+    stage = None
+    started = time.time()
+    try:
+        stage = 'convert'
+        start = time.time()
+        rules = cleaning.load_rules(region['rules'])
+        data.process_map(region['osm'], validate=False, output_dir=csv_dir, rules=rules)
+        stages[stage] = time.time() - start
+
+        stage = 'load'
+        start = time.time()
+        remove_database(region['db'])
+        pool = dbpool.ConnectionPool(region['db'])
+        try:
+            mapdb.load_database(pool, csv_dir)
+            stages[stage] = time.time() - start
+
+            if run_report:
+                stage = 'report'
+                start = time.time()
+                report.run_report(region['db'], pool=pool)
+                stages[stage] = time.time() - start
+        finally:
+            pool.close()
+        result['db_bytes'] = os.path.getsize(region['db'])
+    except Exception:
+        result['status'] = 'failed'
+        result['failed_stage'] = stage
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.time() - started
+    return result
+
+def run_region(results, region, csv_dir, run_report=True):
+    '''Entry point of a worker process: puts the result of process_region() on the results queue.'''
+    results.put(process_region(region, csv_dir, run_report))
+
+def make_csv_dir(region, keep_csv=False):
+    '''Returns the csv directory of a region: its csv_dir with keep_csv, otherwise a new
+    temporary directory next to its database, to be removed by remove_csv_dir().'''
+    csv_dir = region['csv_dir'] if keep_csv else os.path.dirname(region['db'])
+    if not os.path.isdir(csv_dir):
+        os.makedirs(csv_dir)
+    if keep_csv:
+        return csv_dir
+    return tempfile.mkdtemp(prefix='{0}_csv_'.format(region['name']), dir=csv_dir)
+
+def remove_csv_dir(csv_dir, keep_csv=False):
+    '''Removes a csv directory created by make_csv_dir(), unless it was kept.'''
+    if not keep_csv:
+        shutil.rmtree(csv_dir, ignore_errors=True)
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def run_batch(regions, jobs=2, memory_budget=None, run_report=True, keep_csv=False, timeout=None):
+    '''Processes the regions in up to jobs processes, largest first, starting a region
+    only while the estimated memory of the running ones stays within memory_budget (bytes).
+    A region larger than the budget runs alone. A worker that exits without a result
+    (killed, out of memory) or runs longer than timeout seconds fails its region.
+    The csv files of a region are removed once it is done, unless keep_csv.
+    Returns the results in completion order.'''
+    pending = sorted(regions, key=estimate_memory, reverse=True)
+    running = {}
+    results = []
+    queue = multiprocessing.Queue()
+
+    def finish(name, result):
+        '''Records the result of a region, joins its worker and removes its csv files.'''
+        region, process, _, _, csv_dir = running.pop(name)
+        process.join()
+        remove_csv_dir(csv_dir, keep_csv)
+        results.append(result)
+        print >> sys.stderr, "{0}: {1}".format(name, result['status'])
+
+    def collect(wait):
+        '''Records the results put on the queue, waiting up to wait seconds for the first one.'''
+        try:
+            while True:
+                result = queue.get(timeout=wait) if wait else queue.get_nowait()
+                finish(result['name'], result)
+                wait = 0
+        except Queue.Empty:
+            pass
+
+    # One process per region, so each one starts from a clean interpreter and
+    # a worker that dies is seen through its exit code
+    try:
+        while pending or running:
+            used = sum(memory for _, _, _, memory, _ in running.values())
+            for region in list(pending):
+                if len(running) >= jobs:
+                    break
+                memory = estimate_memory(region)
+                if memory_budget is None or not running or used + memory <= memory_budget:
+                    pending.remove(region)
+                    try:
+                        csv_dir = make_csv_dir(region, keep_csv)
+                    except OSError:
+                        results.append({'name': region['name'], 'status': 'failed',
+                                        'error': traceback.format_exc(), 'seconds': 0.0})
+                        print >> sys.stderr, "{0}: failed".format(region['name'])
+                        continue
+                    process = multiprocessing.Process(target=run_region,
+                                                      args=(queue, region, csv_dir, run_report))
+                    running[region['name']] = (region, process, time.time(), memory, csv_dir)
+                    process.start()
+                    used += memory
+
+            collect(0.1)
+            for name, (region, process, started, _, _) in list(running.items()):
+                if process.is_alive():
+                    if timeout is None or time.time() - started <= timeout:
+                        continue
+                    process.terminate()
+                    error = "Timed out after {0:g} seconds".format(timeout)
+                else:
+                    # The result may have been put on the queue just before the worker exited
+                    collect(0)
+                    if name not in running:
+                        continue
+                    error = "Worker exited with code {0} without a result".format(process.exitcode)
+                finish(name, {'name': name, 'status': 'failed', 'error': error,
+                              'seconds': time.time() - started})
+    finally:
+        for _, process, _, _, csv_dir in running.values():
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            remove_csv_dir(csv_dir, keep_csv)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert and load many OSM extracts concurrently.")
+    parser.add_argument('manifest')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--memory-mb', type=float, help="estimated memory budget for running regions")
+    parser.add_argument('--timeout', type=float, help="time limit of one region in seconds")
+    parser.add_argument('--output', default='batch_results.json')
+    parser.add_argument('--keep-csv', action='store_true')
+    parser.add_argument('--no-report', action='store_true')
+    args = parser.parse_args()
+
+    memory_budget = args.memory_mb * 1024 * 1024 if args.memory_mb else None
+    started = time.time()
+    results = run_batch(read_manifest(args.manifest), args.jobs, memory_budget,
+                        not args.no_report, args.keep_csv, args.timeout)
+    summary = {'seconds': time.time() - started,
+               'jobs': args.jobs,
+               'memory_mb': args.memory_mb,
+               'timeout': args.timeout,
+               'failed': [r['name'] for r in results if r['status'] != 'ok'],
+               'regions': results}
+    with open(args.output, 'w') as output:
+        json.dump(summary, output, indent=2, sort_keys=True)
+    if summary['failed']:
+        sys.exit(1)
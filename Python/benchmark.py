@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the pipeline on synthetic OSM files.
+
+For each size, generates a seeded synthetic OSM file (synthetic_osm.py) and
+times every stage: audit, conversion to csv (data.process_map), SQLite load
+and report queries (cold and cached). Results are written as JSON so runs
+can be compared for regressions.
+
+With --profile, the conversion is run a second time under profiling.py to
+break it down into parse, shape, validate and CSV write. The stage timings
+always come from the uninstrumented run.
+
+Usage: python benchmark.py [size_mb ...] [--seed N] [--output results.json]
+                           [--workdir DIR] [--no-validate] [--skip STAGE ...] [--profile]
+"""
+
+# Importing libraries
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import data
+import dbpool
+import mapdb
+import profiling
+import report
+import synthetic_osm
+
+
+STAGES = ['generate', 'audit', 'convert', 'load', 'report']
+
+
+# ================================================== #
+#               Stage Functions                      #
+# ================================================== #
+def audit(osm_path):
+    '''Runs the street, postal code and state audits of data.py.'''
+    timings = {}
+    for name, function in [('audit_streets', data.audit_streets),
+                           ('audit_postcodes', data.audit_postcodes),
+                           ('audit_states', data.audit_states)]:
+        start = time.time()
+        function(osm_path)
+        timings[name] = time.time() - start
+    return timings
+
+def convert(osm_path, output_dir, validate=True):
+    '''Runs data.process_map() and returns its duration.'''
+    start = time.time()
+    data.process_map(osm_path, validate, output_dir)
+    return time.time() - start
+
+def profile_convert(osm_path, output_dir, validate=True):
+    '''Runs data.process_map() under a profiling.Profiler. Returns the per-stage timings
+    taken from the profiler counters and the profiler report.'''
+    with profiling.Profiler() as profiler:
+        data.process_map(osm_path, validate, output_dir)
+    stats = profiler.stats
+    timings = {'parse': stats['get_element'][1],
+               'shape': stats['shape_element'][1],
+               'validate': stats['validate_element'][1],
+               'csv_write': stats['UnicodeDictWriter.writerow'][1] +
+                            stats['UnicodeDictWriter.writerows'][1]}
+    return timings, profiler.report()
+
+def load(db_path, csv_dir):
+    '''Loads the csv files into a new database through mapdb.load_database().'''
+    pool = dbpool.ConnectionPool(db_path)
+    start = time.time()
+    mapdb.load_database(pool, csv_dir)
+    elapsed = time.time() - start
+    pool.close()
+    return elapsed
+
+def run_report(db_path):
+    '''Runs the report twice: cold, then from the cache. Returns the per-query timings.'''
+    pool = dbpool.ConnectionPool(db_path)
+    try:
+        cold = report.run_report(db_path, pool=pool)
+        cached = report.run_report(db_path, pool=pool)
+    finally:
+        pool.close()
+    return {'report': cold['latency'],
+            'report_cached': cached['latency'],
+            'queries': dict((q['name'], q['latency']) for q in cold['queries'])}
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def benchmark(size_mb, workdir, seed=0, validate=True, skip=(), profile=False):
+    '''Runs every stage of the pipeline on a synthetic file of size_mb megabytes.
+    With profile, the convert stage is also broken down by a separate profiled run.'''
+    run_dir = os.path.join(workdir, '{0:g}mb'.format(size_mb))
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+    osm_path = os.path.join(run_dir, 'synthetic.osm')
+    db_path = os.path.join(run_dir, 'synthetic.db')
+    result = {'size_mb': size_mb, 'stages': {}}
+    stages = result['stages']
+
+    # The generated file is the input of every other stage and is never skipped
+    start = time.time()
+    result['elements'] = synthetic_osm.generate(osm_path, size_mb, seed)
+    stages['generate'] = time.time() - start
+    result['osm_bytes'] = os.path.getsize(osm_path)
+
+    if 'audit' not in skip:
+        timings = audit(osm_path)
+        stages.update(timings)
+        stages['audit'] = sum(timings.values())
+
+    if 'convert' not in skip:
+        stages['convert'] = convert(osm_path, run_dir, validate)
+        if profile:
+            timings, result['profile'] = profile_convert(osm_path, run_dir, validate)
+            stages.update(timings)
+        result['csv_bytes'] = sum(os.path.getsize(os.path.join(run_dir, path)) for path in
+                                  [data.NODES_PATH, data.NODE_TAGS_PATH, data.WAYS_PATH,
+                                   data.WAY_NODES_PATH, data.WAY_TAGS_PATH, data.ADDRESSES_PATH])
+
+        if 'load' not in skip:
+            for path in (db_path, db_path + '-wal', db_path + '-shm', db_path + '.report.json'):
+                if os.path.exists(path):
+                    os.remove(path)
+            stages['load'] = load(db_path, run_dir)
+            result['db_bytes'] = os.path.getsize(db_path)
+
+            if 'report' not in skip:
+                timings = run_report(db_path)
+                result['queries'] = timings.pop('queries')
+                stages.update(timings)
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic OSM files.")
+    parser.add_argument('sizes', nargs='*', type=float, default=[10.0],
+                        help="sizes of the synthetic files in MB (default: 10)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--workdir', help="keep generated files in this directory")
+    parser.add_argument('--no-validate', action='store_true',
+                        help="do not validate the shaped elements during convert")
+    parser.add_argument('--skip', nargs='*', default=[], choices=STAGES[1:])
+    parser.add_argument('--profile', action='store_true',
+                        help="break convert down into parse, shape, validate and csv_write "
+                             "with a second, profiled run")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='osm_benchmark_')
+    results = {'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+               'python': platform.python_version(),
+               'sqlite': sqlite3.sqlite_version,
+               'platform': platform.platform(),
+               'seed': args.seed,
+               'validate': not args.no_validate,
+               'profile': args.profile,
+               'runs': []}
+    try:
+        for size_mb in args.sizes:
+            run = benchmark(size_mb, workdir, args.seed, not args.no_validate, args.skip, args.profile)
+            results['runs'].append(run)
+            print >> sys.stderr, "{0:g} MB:".format(size_mb), json.dumps(run['stages'], sort_keys=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Data-driven cleaning rules, so the pipeline runs on other metro areas without
+forking data.py.
+
+A rules file (JSON, see rules/boston_massachusetts.json) gives the street
+suffix mapping, the expected suffixes, the valid postal code prefixes or
+ZIP3 ranges and the aliases of the state. load_rules() compiles them once into
+hash tables and sets, so each cleaned value costs one regex match (street) or
+a few set lookups (postal code, state), whatever the number of rules.
+
+Usage (rule count benchmark): python cleaning.py
+"""
+
+# Importing libraries
+import json
+import os
+import random
+from timeit import default_timer as clock
+
+
+RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+
+
+class CleaningRules(object):
+    '''Cleaning rules of a region compiled into lookup tables.'''
+
+    def __init__(self, region, state, expected, suffixes, postcode_prefixes=(), postcode_ranges=(),
+                 postcode_state_prefixes=(), state_aliases=(), state_alias_prefixes=()):
+        self.region = region
+        self.state = state
+        self.expected = frozenset(expected)
+
+        # Only suffixes that update_name would replace: not expected and not a number
+        self.suffixes = dict((k, v) for k, v in suffixes.items()
+                             if k not in self.expected and not k.isdigit())
+
+        # ZIP3 ranges are expanded into 3-digit prefixes
+        prefixes = set(postcode_prefixes)
+        for first, last in postcode_ranges:
+            prefixes.update('{0:03d}'.format(i) for i in range(int(first), int(last) + 1))
+        self.postcode_prefixes = frozenset(prefixes)
+        self.postcode_prefix_lengths = sorted(set(len(p) for p in prefixes))
+        self.postcode_state_prefixes = frozenset(postcode_state_prefixes)
+        self.postcode_state_prefix_lengths = sorted(set(len(p) for p in postcode_state_prefixes),
+                                                    reverse=True)
+
+        self.state_aliases = frozenset(state_aliases) | frozenset([state])
+        self.state_alias_prefixes = frozenset(state_alias_prefixes)
+        self.state_alias_prefix_lengths = sorted(set(len(p) for p in state_alias_prefixes))
+
+    def valid_postcode(self, post_code):
+        '''Returns True if the postal code starts with a valid prefix of the region.'''
+        for n in self.postcode_prefix_lengths:
+            if post_code[0:n] in self.postcode_prefixes:
+                return True
+        return False
+
+    def strip_postcode_state(self, post_code):
+        '''Returns the postal code without a leading state prefix such as 'MA 02118'.'''
+        for n in self.postcode_state_prefix_lengths:
+            if post_code[0:n] in self.postcode_state_prefixes:
+                return post_code[n:].strip()
+        return post_code
+
+    def is_state(self, state):
+        '''Returns True if the state entry is an alias of the state of the region.'''
+        if state in self.state_aliases:
+            return True
+        for n in self.state_alias_prefix_lengths:
+            if state[0:n] in self.state_alias_prefixes:
+                return True
+        return False
+
+
+_loaded = {}
+
+def load_rules(path):
+    '''Returns the compiled rules of a JSON rules file, compiling each file only once.'''
+    path = os.path.abspath(path)
+    if path not in _loaded:
+        with open(path, 'r') as rules_file:
+            config = json.load(rules_file)
+        _loaded[path] = CleaningRules(
+            config['region'], config['state'], config['expected'], config['suffixes'],
+            config.get('postcode_prefixes', ()), config.get('postcode_ranges', ()),
+            config.get('postcode_state_prefixes', ()), config.get('state_aliases', ()),
+            config.get('state_alias_prefixes', ()))
+    return _loaded[path]
+
+
+# ================================================== #
+#               Rule Count Benchmark                 #
+# ================================================== #
+def scaled_rules(rules, count, seed=0, exclude=()):
+    '''Returns a copy of rules padded with count random suffixes and ZIP3 ranges.
+    The padding never replaces a suffix of rules nor adds a ZIP3 prefix of a postal
+    code in exclude, so the cleaned values stay the same whatever the count.'''
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+    suffixes = dict(rules.suffixes)
+    while len(suffixes) < len(rules.suffixes) + count:
+        suffix = ''.join(rng.choice(letters) for _ in range(rng.randint(2, 8)))
+        if suffix not in suffixes:
+            suffixes[suffix] = 'Street'
+    used = set(rules.strip_postcode_state(code)[0:3] for code in exclude)
+    free = [i for i in range(1000) if '{0:03d}'.format(i) not in used]
+    ranges = [(i, i) for i in rng.sample(free, min(count, len(free)))]
+    return CleaningRules(rules.region, rules.state, rules.expected, suffixes,
+                         rules.postcode_prefixes, ranges, rules.postcode_state_prefixes,
+                         rules.state_aliases, rules.state_alias_prefixes)
+
+def benchmark_rule_count(counts=(0, 100, 1000, 10000, 100000), values=200000, seed=0):
+    '''Measures the per-tag cost of update_name, update_zip and update_state
+    for growing numbers of rules on the same synthetic tag values.'''
+    import data
+    import synthetic_osm
+
+    generator = synthetic_osm.OsmGenerator(seed)
+    tags = []
+    while len(tags) < values:
+        tags.extend((k, v) for k, v in generator.address() if k != u'addr:housenumber')
+    tags = tags[:values]
+
+    results = []
+    # Padding stays clear of the synthetic postal codes, so every count does the same work per tag
+    postcodes = synthetic_osm.CLEAN_POSTCODES + synthetic_osm.DIRTY_POSTCODES
+    for count in counts:
+        rules = scaled_rules(data.RULES, count, seed, postcodes)
+        start = clock()
+        for key, value in tags:
+            if key == u'addr:street':
+                data.update_name(value, rules.suffixes)
+            elif key == u'addr:postcode':
+                data.update_zip(value, rules)
+            elif key == u'addr:state':
+                data.update_state(value, rules)
+        elapsed = clock() - start
+        results.append({'rules': len(rules.suffixes) + len(rules.postcode_prefixes),
+                        'tags': len(tags),
+                        'ns_per_tag': elapsed / len(tags) * 1e9})
+    return results
+
+
+if __name__ == '__main__':
+    print json.dumps(benchmark_rule_count(), indent=2)
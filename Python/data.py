@@ -13,8 +13,10 @@ import re
 from collections import defaultdict
 import csv
 import codecs
+import os
 import cerberus
 import schema
+import cleaning
 
 # Creating sample file as original OSM is 424 MB unzipped.
 # Parameter: take every k-th top level element
@@ -65,25 +67,28 @@ http://pe.usps.gov/text/pub28/28apc_002.htm
 OSMFILE = "boston_massachusetts_sample.osm"
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 
-expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road", 
-            "Trail", "Parkway", "Commons", "Way", "Circle", "Terrace", "Bend", "Manor", "Run", "Highway",
-            "Isle", "Hollow", "Cove", "Lake", "Trace", "Crescent"]
+# Cleaning rules of the region (street suffixes, postal codes, state), see cleaning.py
+# Use another file of the rules directory to clean another metro area.
+RULES_FILE = os.path.join(cleaning.RULES_DIR, "boston_massachusetts.json")
+RULES = cleaning.load_rules(RULES_FILE)
+
+expected = RULES.expected
 
 
 # Create a group of auditing functions for street suffix
-def audit_street_type(street_types, street_name):
+def audit_street_type(street_types, street_name, rules=RULES):
     '''Checks if street name contains incorrect abbreviations, if so, adds it to the dictionary.'''
     m = street_type_re.search(street_name)
     if m:
         street_type = m.group()
-        if street_type not in expected:
+        if street_type not in rules.expected:
             street_types[street_type].add(street_name)
 
 def is_street_name(elem):
     '''Returns a Boolean value'''
     return (elem.attrib['k'] == "addr:street")
 
-def audit(osmfile):
+def audit_streets(osmfile, rules=RULES):
     '''Iterates through document tags, and returns dictionary
     of incorrect abbreviations (keys) and street names (value) that contain these abbreviations.
     '''
@@ -93,78 +98,37 @@ def audit(osmfile):
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
                 if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
+                    audit_street_type(street_types, tag.attrib['v'], rules)
     osm_file.close()
     return street_types
 # Run audit and print results
-st_types = audit(OSMFILE)
-pprint.pprint(dict(st_types))
+if __name__ == '__main__':
+    st_types = audit_streets(OSMFILE)
+    pprint.pprint(dict(st_types))
 
 
 # Function to correct street names using wrong suffix
 def update_name(name, mapping):
-    '''Substitutes incorrect abbreviation with correct one.'''
+    '''Substitutes incorrect abbreviation with correct one.
+    mapping is compiled by cleaning.py without expected or numeric suffixes.'''
     m = street_type_re.search(name)
     if m:
-        street_type = m.group()
-        temp= 0
-        try:
-            temp = int(street_type)
-        except:
-            pass
-        if street_type not in expected and temp == 0:
-            try:
-                name = re.sub(street_type_re, mapping[street_type], name)
-            except:
-                pass
+        better = mapping.get(m.group())
+        if better:
+            name = name[:m.start()] + better + name[m.end():]
     return name
 
 
-# Dictionary mapping incorrect abbreviations to correct one.
-mapping = { "St": "Street",
-            "St.": "Street",
-            "ST": "Street",
-            "st": "Street",
-            "Rd.": "Road",
-            "Rd": "Road",
-            "RD": "Road",
-            "Ave": "Avenue",
-            "Ave.": "Avenue",
-            "Blvd": "Boulevard",
-            "BLVD": "Boulevard",
-            "Cir": "Circle",
-            "Ct": "Court",
-            "Dr": "Drive",
-            "Trl": "Trail",
-            "Ter": "Terrace",
-            "Pl": "Place",
-            "Pkwy": "Parkway",
-            "Bnd": "Bend",
-            "Mnr": "Manor",
-            "Ln": "Lane",
-            "street": "Street",
-            "AVE": "Avenue",
-            "Blvd.": "Boulevard",
-            "Cirlce": "Circle",
-            "DRIVE": "Drive",
-            "Cv": "Cove",
-            "Dr.": "Drive",
-            "Druve": "Drive",
-            "Holw": "Hollow",
-            "Hwy": "Highway",
-            "HWY": "Highway",
-            "Pt": "Point",
-            "Trce": "Trace",
-            "ave": "Avenue",
-            "Cres": "Crescent"
-}
+# Dictionary mapping incorrect abbreviations to correct one, from the rules file.
+mapping = RULES.suffixes
 
 
 # Apply corrections where incorrect detected v. mapping.
-for st_type, ways in st_types.iteritems():
-    for name in ways:
-        better_name = update_name(name, mapping)
-        print name, "=>", better_name
+if __name__ == '__main__':
+    for st_type, ways in st_types.iteritems():
+        for name in ways:
+            better_name = update_name(name, mapping)
+            print name, "=>", better_name
 
 
 
@@ -181,16 +145,16 @@ the original 424 MB OSM file.
 '''
 
 # Create a group of auditing functions for postal codes
-def audit_postcode(post_code, digits):
+def audit_postcode(post_code, digits, rules=RULES):
     '''Checks if postal code is incompatible and adds it to the list if so.'''
-    if len(digits) != 5 or (digits[0:2] != '01' and digits[0:2] != '02'):
+    if len(digits) != 5 or not rules.valid_postcode(digits):
         post_code.append(digits)
 
 def is_postalcode(elem):
     '''Returns a Boolean value.'''
     return (elem.attrib['k'] == "addr:postcode")
 
-def audit(osmfile):
+def audit_postcodes(osmfile, rules=RULES):
     '''Iterates and returns list of inconsistent postal codes found in the document.'''
     osm_file = open(osmfile, "r")
     post_code = []
@@ -198,25 +162,26 @@ def audit(osmfile):
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
                 if is_postalcode(tag):
-                    audit_postcode(post_code, tag.attrib['v'])
+                    audit_postcode(post_code, tag.attrib['v'], rules)
     osm_file.close()
     return post_code
 
 
 # Run audit and print results
-postal_codes = audit(OSMFILE)
-print postal_codes
+if __name__ == '__main__':
+    postal_codes = audit_postcodes(OSMFILE)
+    print postal_codes
 
 
 # Function to correct format of postal codes
-def update_zip(post_code):
+def update_zip(post_code, rules=RULES):
     '''Extracts 5-digit postal codes from postal codes in different formats
-    and deletes postal codes that do not correspond to Massachussets area.'''
-    if post_code[0:2] == 'Ma' or post_code[0:2] == 'MA':
-        post_code = post_code[3:].strip()
-    if len(post_code) >5 and len(post_code) == 10 and (post_code[0:2] == '01' or post_code[0:2] == '02'):
+    and deletes postal codes that do not correspond to the area of the rules.'''
+    post_code = rules.strip_postcode_state(post_code)
+    valid = rules.valid_postcode(post_code)
+    if len(post_code) >5 and len(post_code) == 10 and valid:
         post_code = post_code[0:5]
-    elif len(post_code) < 5 or (post_code[0:2] != '01' and post_code[0:2] != '02') :
+    elif len(post_code) < 5 or not valid:
         post_code = ''
     elif len(post_code) > 5 and post_code[5]==' ':
         post_code = post_code[0:5]
@@ -226,9 +191,10 @@ def update_zip(post_code):
 
 
 # Apply corrections where incorrect detected
-for code in postal_codes:
-    better_code = update_zip(code)
-    print code, "=>", better_code
+if __name__ == '__main__':
+    for code in postal_codes:
+        better_code = update_zip(code)
+        print code, "=>", better_code
 
 
 
@@ -240,16 +206,16 @@ or an empty string, if the state entry is not related to 'MA', such as 'New York
 '''
 
 # Create a group of auditing functions for state entry
-def audit_state(states, state):
+def audit_state(states, state, rules=RULES):
     '''Checks if state entry is inconsistent and, if so, adds it to the list.'''
-    if state != 'MA':
+    if state != rules.state:
         states.append(state)
 
 def is_state(elem):
     '''Returns a Boolean value.'''
     return (elem.attrib['k'] == "addr:state")
 
-def audit(osmfile):
+def audit_states(osmfile, rules=RULES):
     '''Iterates and returns list of inconsistent state entris found in the document.'''
     osm_file = open(osmfile, "r")
     states = []
@@ -257,30 +223,33 @@ def audit(osmfile):
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
                 if is_state(tag):
-                    audit_state(states, tag.attrib['v'])
+                    audit_state(states, tag.attrib['v'], rules)
     osm_file.close()
     return states
 
 
 # Run audit and print results
-states = audit(OSMFILE)
-print states
+if __name__ == '__main__':
+    states = audit_states(OSMFILE)
+    print states
 
 
 # Function to correct state entries
-def update_state(state):
-    '''Deletes U.S. state entries not related to Massachussets and formats all remaining to 'MA'.'''
-    if state.startswith('ma') or state.startswith('Ma') or state.startswith('MA') or state == 'M':
-        state = 'MA'
+def update_state(state, rules=RULES):
+    '''Deletes U.S. state entries not related to the state of the rules and formats all remaining
+    to its abbreviation (ex: 'MA').'''
+    if rules.is_state(state):
+        state = rules.state
     else:
         state = ''
     return state
 
 
 # Apply corrections where incorrect detected
-for state in states:
-    better_state = update_state(state)
-    print state, "=>", better_state
+if __name__ == '__main__':
+    for state in states:
+        better_state = update_state(state)
+        print state, "=>", better_state
 
 
 
@@ -296,6 +265,7 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+ADDRESSES_PATH = "addresses.csv"
 
 
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
@@ -303,6 +273,10 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+ADDRESS_FIELDS = ['element_type', 'id', 'housenumber', 'street', 'postcode', 'city', 'state']
+
+# addr:* keys merged into one address per element
+ADDRESS_KEYS = ('housenumber', 'street', 'postcode', 'city', 'state')
 
 
 # Regular expression compiler patterns.
@@ -313,12 +287,13 @@ SCHEMA = schema.schema
 
 # Check if input element is a "node" or a "way" then clean, shape and parse to corresponding dictionary.
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', rules=RULES):
     '''Clean and shape node or way XML element to Python dict'''
     node_attribs = {}
     way_attribs = {}
     way_nodes = []
     tags = []  # Handle secondary tags the same way for both node and way elements
+    address = {}  # Cleaned addr:* values of the element
 
     if element.tag == 'node':
         for field in node_attr_fields:
@@ -344,31 +319,44 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
             newKey = re.split(":",tag.attrib["k"],1)
             temp['key'] = newKey[1]
             if temp['key'] == 'postcode':
-                temp['value'] = update_zip(tag.attrib["v"])
+                temp['value'] = update_zip(tag.attrib["v"], rules)
             elif temp['key'] == 'state':
-                temp['value'] = update_state(tag.attrib["v"])
+                temp['value'] = update_state(tag.attrib["v"], rules)
             elif temp['key'] == 'street':
-                temp['value'] = update_name(tag.attrib["v"],mapping)
+                temp['value'] = update_name(tag.attrib["v"], rules.suffixes)
             else:
                 temp['value'] = tag.attrib["v"]
             temp["type"] = newKey[0]
+            if newKey[0] == 'addr' and temp['key'] in ADDRESS_KEYS:
+                address[temp['key']] = temp['value']
         else:
             temp['key'] = tag.attrib["k"]
             if temp['key'] == 'postcode':
-                temp['value'] = update_zip(tag.attrib["v"])
+                temp['value'] = update_zip(tag.attrib["v"], rules)
             elif temp['key'] == 'state':
-                temp['value'] = update_state(tag.attrib["v"])
+                temp['value'] = update_state(tag.attrib["v"], rules)
             elif temp['key'] == 'street':
-                temp['value'] = update_name(tag.attrib["v"],mapping)
+                temp['value'] = update_name(tag.attrib["v"], rules.suffixes)
             else:
                 temp['value'] = tag.attrib["v"]
             temp["type"] = default_tag_type
         tags.append(temp.copy())
 
+    if address:
+        address['element_type'] = element.tag
+        address['id'] = element.attrib["id"]
+        for key in ADDRESS_KEYS:
+            address.setdefault(key, '')
+
     if element.tag == 'node':
-        return {'node': node_attribs, 'node_tags': tags}
+        shaped = {'node': node_attribs, 'node_tags': tags}
     elif element.tag == 'way':
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        shaped = {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+    else:
+        return None
+    if address:
+        shaped['address'] = address
+    return shaped
 
 
 # ================================================== #
@@ -412,31 +400,34 @@ class UnicodeDictWriter(csv.DictWriter, object):
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate):
-    '''Iteratively process each XML element and write to csv(s)'''
+def process_map(file_in, validate, output_dir='', rules=RULES):
+    '''Iteratively process each XML element, clean it with rules and write to csv(s) in output_dir'''
 
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-         codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-         codecs.open(WAYS_PATH, 'w') as ways_file, \
-         codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-         codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
+    with codecs.open(os.path.join(output_dir, NODES_PATH), 'w') as nodes_file, \
+         codecs.open(os.path.join(output_dir, NODE_TAGS_PATH), 'w') as nodes_tags_file, \
+         codecs.open(os.path.join(output_dir, WAYS_PATH), 'w') as ways_file, \
+         codecs.open(os.path.join(output_dir, WAY_NODES_PATH), 'w') as way_nodes_file, \
+         codecs.open(os.path.join(output_dir, WAY_TAGS_PATH), 'w') as way_tags_file, \
+         codecs.open(os.path.join(output_dir, ADDRESSES_PATH), 'w') as addresses_file:
 
         nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
         node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
         ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
         way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
         way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
+        addresses_writer = UnicodeDictWriter(addresses_file, ADDRESS_FIELDS)
 
         nodes_writer.writeheader()
         node_tags_writer.writeheader()
         ways_writer.writeheader()
         way_nodes_writer.writeheader()
         way_tags_writer.writeheader()
+        addresses_writer.writeheader()
 
         validator = cerberus.Validator()
 
         for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+            el = shape_element(element, rules=rules)
             if el:
                 if validate is True:
                     validate_element(el, validator)
@@ -448,9 +439,12 @@ def process_map(file_in, validate):
                     ways_writer.writerow(el['way'])
                     way_nodes_writer.writerows(el['way_nodes'])
                     way_tags_writer.writerows(el['way_tags'])
+                if 'address' in el:
+                    addresses_writer.writerow(el['address'])
 
 
-process_map(OSMFILE, validate=False)
+if __name__ == '__main__':
+    process_map(OSMFILE, validate=False)
 
 
 
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled SQLite access for loading and querying BostonMA.db.
+
+The database is switched to WAL mode so readers are never blocked by a load
+in progress. Readers share a thread-safe pool of read-only connections, loads
+go through a single writer connection, and every connection gets the same
+page cache and memory-map settings.
+
+Usage (concurrent-read benchmark): python dbpool.py BostonMA.db [seconds]
+"""
+
+# Importing libraries
+import json
+import os
+import Queue
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib
+from contextlib import contextmanager
+
+
+# Per-connection settings: 64 MB page cache (negative value is in KiB) and 256 MB memory map
+CACHE_SIZE = -65536
+MMAP_SIZE = 268435456
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def connect_readonly(db_path):
+    '''Opens a read-only connection to the database.'''
+    try:
+        return sqlite3.connect('file:{0}?mode=ro'.format(urllib.pathname2url(os.path.abspath(db_path))),
+                               uri=True, check_same_thread=False)
+    except TypeError:
+        # sqlite3 of Python 2 has no URI support
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        db.execute("PRAGMA query_only = ON;")
+        return db
+
+def configure(db, cache_size=CACHE_SIZE, mmap_size=MMAP_SIZE):
+    '''Applies the page cache and memory-map settings to a connection.'''
+    db.execute("PRAGMA cache_size = {0:d};".format(cache_size))
+    db.execute("PRAGMA mmap_size = {0:d};".format(mmap_size))
+    return db
+
+
+class ConnectionPool(object):
+    '''Thread-safe pool of read-only connections plus a single writer connection.'''
+
+    def __init__(self, db_path, readers=4, cache_size=CACHE_SIZE, mmap_size=MMAP_SIZE):
+        self.db_path = db_path
+        self.max_readers = readers
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._idle = Queue.LifoQueue()
+        self._readers = []
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def acquire_reader(self):
+        '''Returns an idle reader, opening a new one while below the pool size,
+        otherwise waits for one to be released.'''
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            if len(self._readers) < self.max_readers:
+                db = configure(connect_readonly(self.db_path), self.cache_size, self.mmap_size)
+                self._readers.append(db)
+                return db
+        return self._idle.get()
+
+    def release_reader(self, db):
+        '''Returns a reader to the pool.'''
+        self._idle.put(db)
+
+    def acquire_writer(self):
+        '''Returns the writer connection, waiting while another thread holds it.
+        The first call switches the database to WAL mode.'''
+        self._writer_lock.acquire()
+        try:
+            if self._writer is None:
+                db = sqlite3.connect(self.db_path, check_same_thread=False)
+                try:
+                    db.execute("PRAGMA journal_mode = WAL;")
+                    db.execute("PRAGMA synchronous = NORMAL;")
+                    configure(db, self.cache_size, self.mmap_size)
+                except:
+                    db.close()
+                    raise
+                self._writer = db
+        except:
+            self._writer_lock.release()
+            raise
+        return self._writer
+
+    def release_writer(self, db):
+        '''Commits pending changes, or rolls them back if the commit fails,
+        and releases the writer connection.'''
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            self._writer_lock.release()
+
+    @contextmanager
+    def reader(self):
+        '''Context manager around acquire_reader() and release_reader().'''
+        db = self.acquire_reader()
+        try:
+            yield db
+        finally:
+            self.release_reader(db)
+
+    @contextmanager
+    def writer(self):
+        '''Context manager around acquire_writer() and release_writer(),
+        rolling back the transaction if the block raises.'''
+        db = self.acquire_writer()
+        try:
+            yield db
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            self.release_writer(db)
+
+    def close(self):
+        '''Closes all connections of the pool.'''
+        with self._lock:
+            for db in self._readers:
+                db.close()
+            self._readers = []
+            self._idle = Queue.LifoQueue()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+# ================================================== #
+#               Concurrent-read Benchmark            #
+# ================================================== #
+def benchmark_reads(db_path, queries, readers=(1, 2, 4, 8), seconds=5.0):
+    '''Measures report query throughput for each number of reader threads
+    while a writer thread keeps loading rows into a scratch table.
+    Runs on a temporary copy of the database, which is left untouched.'''
+    temp_dir = tempfile.mkdtemp(prefix='dbpool_bench_')
+    try:
+        # The WAL file holds committed pages not yet checkpointed, so it is copied too
+        bench_path = os.path.join(temp_dir, os.path.basename(db_path))
+        shutil.copyfile(db_path, bench_path)
+        if os.path.exists(db_path + '-wal'):
+            shutil.copyfile(db_path + '-wal', bench_path + '-wal')
+        return _benchmark_reads(bench_path, queries, readers, seconds)
+    finally:
+        shutil.rmtree(temp_dir)
+
+def _benchmark_reads(db_path, queries, readers, seconds):
+    '''Runs benchmark_reads() on db_path, which is modified.'''
+    results = []
+    pool = ConnectionPool(db_path, readers=max(readers))
+    with pool.writer() as db:
+        db.execute("CREATE TABLE bench_load (id INTEGER, value TEXT);")
+
+    for count in readers:
+        stop = threading.Event()
+        done = [0] * count
+        written = [0]
+
+        def load():
+            while not stop.is_set():
+                with pool.writer() as db:
+                    db.executemany("INSERT INTO bench_load(id, value) VALUES (?, ?);",
+                                   [(i, 'x' * 32) for i in range(1000)])
+                written[0] += 1000
+
+        def read(n):
+            i = 0
+            while not stop.is_set():
+                with pool.reader() as db:
+                    db.execute(queries[i % len(queries)][1]).fetchall()
+                done[n] += 1
+                i += 1
+
+        threads = [threading.Thread(target=load)]
+        threads += [threading.Thread(target=read, args=(n,)) for n in range(count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        results.append({'readers': count,
+                        'queries': sum(done),
+                        'queries_per_second': sum(done) / elapsed,
+                        'rows_loaded': written[0]})
+
+    pool.close()
+    return results
+
+
+if __name__ == '__main__':
+    import report
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    print json.dumps(benchmark_reads(sys.argv[1], report.QUERIES, seconds=seconds), indent=2)
@@ -16,259 +16,262 @@ import codecs
 import cerberus
 import schema
 import sqlite3
+import os
+import time
+import json
+import report
+import dbpool
 
 
 ''' Step #5:  Import CSV files into SQL tables
 Using the code provided by Project Details instructions.'''
 
 
-# Create base
-db = sqlite3.connect("BostonMA.db")
-c = db.cursor()
+DB_PATH = "BostonMA.db"
 
+# CSV files written by data.py, as ( filename, table, schema.py element type, fields )
+CSV_FILES = [
+    ('nodes.csv', 'nodes', 'node', ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+    ('nodes_tags.csv', 'nodes_tags', 'node_tags', ['id', 'key', 'value', 'type']),
+    ('ways.csv', 'ways', 'way', ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+    ('ways_nodes.csv', 'ways_nodes', 'way_nodes', ['id', 'node_id', 'position']),
+    ('ways_tags.csv', 'ways_tags', 'way_tags', ['id', 'key', 'value', 'type']),
+    ('addresses.csv', 'addresses', 'address',
+     ['element_type', 'id', 'housenumber', 'street', 'postcode', 'city', 'state']),
+]
 
 
 # Create tables
-c.execute('''
-CREATE TABLE nodes (
-    id INTEGER PRIMARY KEY NOT NULL,
-    lat REAL,
-    lon REAL,
-    user TEXT,
-    uid INTEGER,
-    version INTEGER,
-    changeset INTEGER,
-    timestamp TEXT
-);
-''')
-
-c.execute('''
-CREATE TABLE nodes_tags (
-    id INTEGER,
-    key TEXT,
-    value TEXT,
-    type TEXT,
-    FOREIGN KEY (id) REFERENCES nodes(id)
-);
-''')
-
-c.execute('''
-CREATE TABLE ways (
-    id INTEGER PRIMARY KEY NOT NULL,
-    user TEXT,
-    uid INTEGER,
-    version TEXT,
-    changeset INTEGER,
-    timestamp TEXT
-);
-''')
-
-c.execute('''
-CREATE TABLE ways_tags (
-    id INTEGER NOT NULL,
-    key TEXT NOT NULL,
-    value TEXT NOT NULL,
-    type TEXT,
-    FOREIGN KEY (id) REFERENCES ways(id)
-);
-''')
-
-c.execute('''
-CREATE TABLE ways_nodes (
-    id INTEGER NOT NULL,
-    node_id INTEGER NOT NULL,
-    position INTEGER NOT NULL,
-    FOREIGN KEY (id) REFERENCES ways(id),
-    FOREIGN KEY (node_id) REFERENCES nodes(id)
-);
-''')
-# commit the changes
-db.commit()
-
-
-
-# Read in the csv file as a dictionary, format the data as a list of tuples:
-with open('nodes.csv','rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['lat'], i['lon'], i['user'].decode("utf-8"), i['uid'], i['version'], i['changeset'], i['timestamp']) for i in dr]
-
-# insert the formatted data
-c.executemany("INSERT INTO nodes(id, lat, lon, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", to_db)
-# commit the changes
-db.commit()
-
-
-with open('nodes_tags.csv','rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['key'], i['value'].decode("utf-8"), i['type']) for i in dr]
-    
-# insert the formatted data
-c.executemany("INSERT INTO nodes_tags(id, key, value,type) VALUES (?, ?, ?, ?);", to_db)
-# commit the changes
-db.commit()
-
-
-with open('ways.csv','rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['user'].decode("utf-8"), i['uid'], i['version'], i['changeset'], i['timestamp']) for i in dr]
-    
-# insert the formatted data
-c.executemany("INSERT INTO ways(id, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?);", to_db)
-# commit the changes
-db.commit()
-
-
-with open('ways_nodes.csv','rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['node_id'], i['position']) for i in dr]
-    
-# insert the formatted data
-c.executemany("INSERT INTO ways_nodes(id, node_id, position) VALUES (?, ?, ?);", to_db)
-# commit the changes
-db.commit()
-
-
-with open('ways_tags.csv','rb') as fin:
-    dr = csv.DictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['key'], i['value'].decode("utf-8"), i['type']) for i in dr]
-    
-# insert the formatted data
-c.executemany("INSERT INTO ways_tags(id, key, value, type) VALUES (?, ?, ?, ?);", to_db)
-# commit the changes
-db.commit()
-
-
-#db = sqlite3.connect("BostonMA.db")
-#c = db.cursor()
-
-
-# Number of Nodes
-query = "SELECT count(*) FROM nodes;"
-c.execute(query)
-c.fetchall()[0][0]
-
-
-# Number of Ways
-query = "SELECT count(*) FROM ways;"
-c.execute(query)
-c.fetchall()[0][0]
-
-
-# Number of Unique Users
-query = "SELECT count(DISTINCT(temp.uid)) FROM (SELECT user, uid FROM ways UNION ALL SELECT user, uid FROM nodes) as temp;"
-c.execute(query)
-c.fetchall()[0][0]
-
-
-# Top 10 Contributors
-query = "SELECT temp.user, count(*) as posts FROM (SELECT user, uid FROM ways UNION ALL SELECT user, uid FROM nodes) as temp \
-GROUP BY temp.user ORDER BY posts DESC LIMIT 10;"
-c.execute(query)
-c.fetchall()
-
-
-# Top 5 common Way tags
-query = "SELECT key, count(*) FROM ways_tags GROUP BY 1 ORDER BY count(*) DESC LIMIT 5;"
-c.execute(query)
-c.fetchall()
-
-
-# Top 5 common Node tags
-query = "SELECT key,count(*) FROM nodes_tags GROUP BY 1 ORDER BY count(*) DESC LIMIT 5;"
-c.execute(query)
-c.fetchall()
-
-
-# Number of wheelchair access information
-query = "SELECT count(*) FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) \
-WHERE key='wheelchair';"
-c.execute(query)
-c.fetchall()[0][0]
-
-
-# Number of Amenities
-query = "SELECT count(*) FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) \
-WHERE key='amenity';"
-c.execute(query)
-c.fetchall()[0][0]
-
-
-# Top 20 Amenities
-query = "SELECT temp.value, count(*) as num \
-FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
-WHERE temp.key='amenity' GROUP BY temp.value ORDER BY num DESC LIMIT 20;"
-c.execute(query)
-c.fetchall()
-
-
-# Top 10 postal codes
-query = "SELECT temp.value, count(*) as num \
-FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
-WHERE temp.key = 'postcode' GROUP BY temp.value ORDER BY num DESC LIMIT 10;"
-c.execute(query)
-c.fetchall()
-
-
-# Top 10 Cities
-query = "SELECT temp.value, count(*) as num \
-FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
-WHERE temp.key = 'city' GROUP BY temp.value ORDER BY num DESC LIMIT 10;"
-c.execute(query)
-c.fetchall()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+def create_tables(c):
+    '''Creates the tables of the Project Details schema.'''
+    c.execute('''
+    CREATE TABLE nodes (
+        id INTEGER PRIMARY KEY NOT NULL,
+        lat REAL,
+        lon REAL,
+        user TEXT,
+        uid INTEGER,
+        version INTEGER,
+        changeset INTEGER,
+        timestamp INTEGER
+    );
+    ''')
+
+    c.execute('''
+    CREATE TABLE nodes_tags (
+        id INTEGER,
+        key TEXT,
+        value TEXT,
+        type TEXT,
+        FOREIGN KEY (id) REFERENCES nodes(id)
+    );
+    ''')
+
+    c.execute('''
+    CREATE TABLE ways (
+        id INTEGER PRIMARY KEY NOT NULL,
+        user TEXT,
+        uid INTEGER,
+        version INTEGER,
+        changeset INTEGER,
+        timestamp INTEGER
+    );
+    ''')
+
+    c.execute('''
+    CREATE TABLE ways_tags (
+        id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        type TEXT,
+        FOREIGN KEY (id) REFERENCES ways(id)
+    );
+    ''')
+
+    c.execute('''
+    CREATE TABLE ways_nodes (
+        id INTEGER NOT NULL,
+        node_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        FOREIGN KEY (id) REFERENCES ways(id),
+        FOREIGN KEY (node_id) REFERENCES nodes(id)
+    );
+    ''')
+
+    # Cleaned addr:* tags merged into one row per node or way
+    c.execute('''
+    CREATE TABLE addresses (
+        element_type TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        housenumber TEXT,
+        street TEXT,
+        postcode TEXT,
+        city TEXT,
+        state TEXT,
+        PRIMARY KEY (element_type, id)
+    );
+    ''')
+
+    # Full-text index over addresses, kept in sync by the triggers of create_indexes()
+    c.execute('''
+    CREATE VIRTUAL TABLE addresses_fts USING fts5(
+        housenumber, street, postcode, city, state,
+        content='addresses', content_rowid='rowid'
+    );
+    ''')
+
+
+# Coerce each CSV column once, using the type definitions in schema.py,
+# so SQLite receives native INTEGER/REAL values instead of applying affinity
+# conversion row by row. Timestamps are stored as integer epoch seconds.
+def decode_utf8(value):
+    '''Default conversion for TEXT columns without a coercion rule in schema.py.'''
+    return value.decode("utf-8")
+
+def get_converters(element, fields, schema=schema.schema):
+    '''Returns the list of conversion functions for the fields of an element type in schema.py.'''
+    rules = schema[element]['schema']
+    if schema[element]['type'] == 'list':
+        rules = rules['schema']
+    return [rules[field].get('coerce', decode_utf8) for field in fields]
+
+def load_csv(c, filename, table, element, fields):
+    '''Reads the csv file, converts every row to typed tuples and inserts them into table.
+    Rows are streamed to executemany(), so memory use does not grow with the file size.'''
+    converters = get_converters(element, fields)
+    with open(filename,'rb') as fin:
+        dr = csv.reader(fin) # comma is default delimiter
+        header = next(dr)
+        columns = [header.index(field) for field in fields]
+        to_db = (tuple(convert(row[i]) for convert, i in zip(converters, columns)) for row in dr)
+
+        # insert the formatted data
+        c.executemany("INSERT INTO {0}({1}) VALUES ({2});".format(table, ", ".join(fields),
+                                                                 ", ".join("?" * len(fields))), to_db)
+
+
+# Index timestamps for time-range queries and sorts, and addresses for full-text search
+def create_indexes(c):
+    '''Creates the secondary indexes once the tables are loaded.'''
+    c.execute("CREATE INDEX nodes_timestamp ON nodes(timestamp);")
+    c.execute("CREATE INDEX ways_timestamp ON ways(timestamp);")
+
+    # Index the bulk-loaded addresses at once, then keep the index in sync row by row
+    c.execute("INSERT INTO addresses_fts(addresses_fts) VALUES ('rebuild');")
+    c.execute('''
+    CREATE TRIGGER addresses_insert AFTER INSERT ON addresses BEGIN
+        INSERT INTO addresses_fts(rowid, housenumber, street, postcode, city, state)
+        VALUES (new.rowid, new.housenumber, new.street, new.postcode, new.city, new.state);
+    END;
+    ''')
+    c.execute('''
+    CREATE TRIGGER addresses_delete AFTER DELETE ON addresses BEGIN
+        INSERT INTO addresses_fts(addresses_fts, rowid, housenumber, street, postcode, city, state)
+        VALUES ('delete', old.rowid, old.housenumber, old.street, old.postcode, old.city, old.state);
+    END;
+    ''')
+    c.execute('''
+    CREATE TRIGGER addresses_update AFTER UPDATE ON addresses BEGIN
+        INSERT INTO addresses_fts(addresses_fts, rowid, housenumber, street, postcode, city, state)
+        VALUES ('delete', old.rowid, old.housenumber, old.street, old.postcode, old.city, old.state);
+        INSERT INTO addresses_fts(rowid, housenumber, street, postcode, city, state)
+        VALUES (new.rowid, new.housenumber, new.street, new.postcode, new.city, new.state);
+    END;
+    ''')
+
+
+# Incremental rebuild of addresses from the tag tables
+def rebuild_addresses(c, element_type, ids=None):
+    '''Re-merges the addr:* tags of the given nodes or ways (element_type 'node' or 'way')
+    into addresses, or of all of them if ids is None. The triggers update the full-text index.
+    As in data.shape_element, the last of duplicate tags wins: tag rows are inserted in
+    document order, so it is the one with the highest rowid.'''
+    tags_table = {'node': 'nodes_tags', 'way': 'ways_tags'}[element_type]
+    if ids is None:
+        chunks = [()]
+    else:
+        ids = list(ids)
+        chunks = [tuple(ids[i:i + 500]) for i in range(0, len(ids), 500)]
+
+    for chunk in chunks:
+        where = "AND id IN ({0})".format(", ".join("?" * len(chunk))) if chunk else ""
+        c.execute("DELETE FROM addresses WHERE element_type = ? {0};".format(where),
+                  (element_type,) + chunk)
+        c.execute('''
+        INSERT INTO addresses(element_type, id, housenumber, street, postcode, city, state)
+        SELECT ?, id,
+            coalesce(max(CASE WHEN key = 'housenumber' THEN value END), ''),
+            coalesce(max(CASE WHEN key = 'street' THEN value END), ''),
+            coalesce(max(CASE WHEN key = 'postcode' THEN value END), ''),
+            coalesce(max(CASE WHEN key = 'city' THEN value END), ''),
+            coalesce(max(CASE WHEN key = 'state' THEN value END), '')
+        FROM (-- one row per key: with max(), SQLite takes value from the row of the last tag
+            SELECT id, key, value, max(rowid)
+            FROM {0}
+            WHERE type = 'addr' AND key IN ('housenumber', 'street', 'postcode', 'city', 'state') {1}
+            GROUP BY id, key)
+        GROUP BY id;
+        '''.format(tags_table, where), (element_type,) + chunk)
+
+
+# Address lookup
+def search_addresses(c, text, limit=10):
+    '''Returns the addresses matching all the words of text (ex: '12 Main Street 02118'),
+    best matches first. A blank text matches nothing.'''
+    words = text.split()
+    if not words:
+        return []
+    match = " ".join('"{0}"'.format(word.replace('"', '""')) for word in words)
+    return c.execute('''
+    SELECT a.element_type, a.id, a.housenumber, a.street, a.postcode, a.city, a.state
+    FROM addresses_fts JOIN addresses a ON a.rowid = addresses_fts.rowid
+    WHERE addresses_fts MATCH ? ORDER BY rank LIMIT ?;
+    ''', (match, limit)).fetchall()
+
+
+def load_database(pool, csv_dir=''):
+    '''Creates the tables and loads the csv files of csv_dir through the writer of the pool.'''
+    with pool.writer() as db:
+        c = db.cursor()
+        create_tables(c)
+        for filename, table, element, fields in CSV_FILES:
+            load_csv(c, os.path.join(csv_dir, filename), table, element, fields)
+        create_indexes(c)
+
+    # Move the loaded pages from the WAL into the database file
+    with pool.writer() as db:
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+
+# Storage and query timing
+# Run against a database built with the previous TEXT columns to compare.
+def time_query(c, query, params=(), repeat=5):
+    '''Returns the best wall time in seconds of repeat executions of query.'''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        c.execute(query, params).fetchall()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    # Create base, loads go through the single writer connection of the pool
+    pool = dbpool.ConnectionPool(DB_PATH)
+    load_database(pool)
+
+    with pool.reader() as db:
+        c = db.cursor()
+        print "Database size:", os.path.getsize(DB_PATH), "bytes"
+        print "Time range (2016):", time_query(c, "SELECT count(*) FROM nodes WHERE timestamp >= ? AND timestamp < ?;",
+                                               (schema.epoch_seconds('2016-01-01T00:00:00Z'),
+                                                schema.epoch_seconds('2017-01-01T00:00:00Z'))), "s"
+        print "Latest 100 edits:", time_query(c, "SELECT id FROM nodes ORDER BY timestamp DESC LIMIT 100;"), "s"
+        print "Address search:", time_query(c, "SELECT rowid FROM addresses_fts WHERE addresses_fts MATCH ? LIMIT 10;",
+                                            ('"Main" "Street"',)), "s"
+
+    # Run the statistics queries defined in report.py
+    print json.dumps(report.run_report(DB_PATH, pool=pool), indent=2)
+    pool.close()
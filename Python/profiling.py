@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the hot functions of data.py.
+
+While enabled, get_element, shape_element, update_name, update_zip,
+update_state, validate_element and the csv writers are replaced in data.py by
+wrappers that count calls and accumulate wall time (inclusive of callees).
+Optionally, every k-th element is profiled with cProfile from parsing to csv
+writing, and the stats are dumped for pstats, snakeviz or flameprof.
+
+The original functions are restored on disable, so there is no overhead at
+all when profiling is off.
+
+Usage: python profiling.py input.osm [--sample-every K] [--output shape.prof] [--validate]
+"""
+
+# Importing libraries
+import argparse
+import cProfile
+import shutil
+import tempfile
+from timeit import default_timer as clock
+import data
+
+
+# Functions of data.py called through module globals, and methods of the csv writer
+HOT_FUNCTIONS = ['get_element', 'shape_element', 'update_name', 'update_zip', 'update_state',
+                 'validate_element']
+HOT_METHODS = [(data.UnicodeDictWriter, 'writerow'), (data.UnicodeDictWriter, 'writerows')]
+
+
+class Profiler(object):
+    '''Call counters and cumulative timers for the hot functions of data.py,
+    with optional cProfile sampling of every sample_every-th element.'''
+
+    def __init__(self, sample_every=0):
+        self.stats = {}
+        self.sample_every = sample_every
+        self.profile = cProfile.Profile() if sample_every else None
+        self._originals = []
+
+    def _counted(self, name, function):
+        '''Returns function wrapped with a call counter and cumulative timer.'''
+        stat = self.stats.setdefault(name, [0, 0.0])
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat[0] += 1
+                stat[1] += clock() - start
+        return wrapper
+
+    def _counted_generator(self, name, function):
+        '''Returns a generator function wrapped to count yielded items and time spent producing them.
+        With sampling, the profiler runs while every sample_every-th item is being processed.'''
+        stat = self.stats.setdefault(name, [0, 0.0])
+        profile, every = self.profile, self.sample_every
+
+        def wrapper(*args, **kwargs):
+            items = function(*args, **kwargs)
+            i = 0
+            while True:
+                start = clock()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                stat[0] += 1
+                stat[1] += clock() - start
+                sample = profile is not None and i % every == 0
+                if sample:
+                    profile.enable()
+                try:
+                    yield item
+                finally:
+                    if sample:
+                        profile.disable()
+                i += 1
+        return wrapper
+
+    def enable(self):
+        '''Replaces the hot functions of data.py with their counting wrappers.'''
+        if self._originals:
+            return
+        for name in HOT_FUNCTIONS:
+            function = getattr(data, name)
+            self._originals.append((data, name, function))
+            if name == 'get_element':
+                setattr(data, name, self._counted_generator(name, function))
+            else:
+                setattr(data, name, self._counted(name, function))
+        for cls, name in HOT_METHODS:
+            function = cls.__dict__[name]
+            self._originals.append((cls, name, function))
+            setattr(cls, name, self._counted('{0}.{1}'.format(cls.__name__, name), function))
+
+    def disable(self):
+        '''Restores the original functions of data.py.'''
+        while self._originals:
+            owner, name, function = self._originals.pop()
+            setattr(owner, name, function)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def report(self):
+        '''Returns the counters sorted by cumulative time, as a list of dicts.'''
+        rows = [{'name': name, 'calls': calls, 'seconds': seconds,
+                 'us_per_call': seconds / calls * 1e6 if calls else 0.0}
+                for name, (calls, seconds) in self.stats.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def dump(self, path):
+        '''Writes the sampled cProfile stats to path.'''
+        self.profile.dump_stats(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Profile the conversion of an OSM file to csv.")
+    parser.add_argument('osm_file')
+    parser.add_argument('--sample-every', type=int, default=0,
+                        help="cProfile every k-th element (default: 0, no sampling)")
+    parser.add_argument('--output', default='shape.prof', help="cProfile stats file")
+    parser.add_argument('--validate', action='store_true')
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix='osm_profile_')
+    try:
+        with Profiler(args.sample_every) as profiler:
+            data.process_map(args.osm_file, validate=args.validate, output_dir=output_dir)
+    finally:
+        shutil.rmtree(output_dir)
+
+    print "{0:<36}{1:>12}{2:>12}{3:>12}".format("function", "calls", "seconds", "us/call")
+    for row in profiler.report():
+        print "{name:<36}{calls:>12}{seconds:>12.3f}{us_per_call:>12.2f}".format(**row)
+    if args.sample_every:
+        profiler.dump(args.output)
+        print "cProfile stats of every {0}th element written to {1}".format(args.sample_every, args.output)
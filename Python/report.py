@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Report runner for the statistics queries of mapdb.py.
+
+Runs the named queries on pooled read-only connections (optionally in
+parallel), reuses each connection's prepared statements and caches the
+results next to the database, keyed on query text plus the SQLite file
+change counter.
+Re-running the report on an unchanged database is served from the cache.
+
+Usage: python report.py BostonMA.db [workers]
+"""
+
+# Importing libraries
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+import dbpool
+
+
+''' Step #6:  Run SQL queries
+Named queries in report order, as ( name, query ).'''
+
+QUERIES = [
+    # Number of Nodes
+    ('nodes', "SELECT count(*) FROM nodes;"),
+
+    # Number of Ways
+    ('ways', "SELECT count(*) FROM ways;"),
+
+    # Number of Unique Users
+    ('unique_users', "SELECT count(DISTINCT(temp.uid)) FROM (SELECT user, uid FROM ways UNION ALL SELECT user, uid FROM nodes) as temp;"),
+
+    # Top 10 Contributors
+    ('top_contributors', "SELECT temp.user, count(*) as posts FROM (SELECT user, uid FROM ways UNION ALL SELECT user, uid FROM nodes) as temp \
+GROUP BY temp.user ORDER BY posts DESC LIMIT 10;"),
+
+    # Top 5 common Way tags
+    ('top_way_tags', "SELECT key, count(*) FROM ways_tags GROUP BY 1 ORDER BY count(*) DESC LIMIT 5;"),
+
+    # Top 5 common Node tags
+    ('top_node_tags', "SELECT key,count(*) FROM nodes_tags GROUP BY 1 ORDER BY count(*) DESC LIMIT 5;"),
+
+    # Number of wheelchair access information
+    ('wheelchair', "SELECT count(*) FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) \
+WHERE key='wheelchair';"),
+
+    # Number of Amenities
+    ('amenities', "SELECT count(*) FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) \
+WHERE key='amenity';"),
+
+    # Top 20 Amenities
+    ('top_amenities', "SELECT temp.value, count(*) as num \
+FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
+WHERE temp.key='amenity' GROUP BY temp.value ORDER BY num DESC LIMIT 20;"),
+
+    # Top 10 postal codes
+    ('top_postcodes', "SELECT temp.value, count(*) as num \
+FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
+WHERE temp.key = 'postcode' GROUP BY temp.value ORDER BY num DESC LIMIT 10;"),
+
+    # Top 10 Cities
+    ('top_cities', "SELECT temp.value, count(*) as num \
+FROM (SELECT key,value FROM ways_tags UNION ALL SELECT key,value FROM nodes_tags) as temp \
+WHERE temp.key = 'city' GROUP BY temp.value ORDER BY num DESC LIMIT 10;"),
+]
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def change_counter(db_path):
+    '''Returns a token that changes on every committed write: the file change counter
+    from the database header (bytes 24-27) and modification time, plus the WAL
+    salt and size, as SQLite does not update the header counter in WAL mode.'''
+    with open(db_path, 'rb') as db_file:
+        header = db_file.read(28)
+    token = [struct.unpack('>I', header[24:28])[0], os.path.getmtime(db_path)]
+    wal_path = db_path + '-wal'
+    # Readers create an empty WAL file on open, which holds no changes
+    if os.path.exists(wal_path) and os.path.getsize(wal_path) >= 32:
+        with open(wal_path, 'rb') as wal_file:
+            wal_header = wal_file.read(24)
+        token += [wal_header[16:24].encode('hex'), os.path.getsize(wal_path)]
+    return ':'.join(str(value) for value in token)
+
+def cache_key(query, counter):
+    '''Returns the cache key for a query text at a database change counter.'''
+    return hashlib.sha1("{0}:{1}".format(counter, query)).hexdigest()
+
+def load_cache(cache_path, counter):
+    '''Returns the cached results for the change counter, or an empty cache if the file
+    is missing, unreadable or was written for another state of the database.'''
+    try:
+        with open(cache_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+    if cache.get('change_counter') != counter:
+        return {}
+    return cache['results']
+
+def save_cache(cache_path, counter, cache):
+    '''Writes the cache atomically so concurrent readers never see a partial file.
+    Each writer uses its own temporary file, the last rename wins.'''
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(cache_path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump({'change_counter': counter, 'results': cache}, cache_file)
+        os.rename(temp_path, cache_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def run_report(db_path, queries=QUERIES, workers=1, cache_path=None, pool=None):
+    '''Runs the named queries and returns a structured report with per-query latency.
+    Results of an unchanged database are returned from the cache. Readers are
+    taken from pool when given, otherwise from a pool of workers connections.'''
+    if cache_path is None:
+        cache_path = db_path + '.report.json'
+    started = time.time()
+    counter = change_counter(db_path)
+    cache = load_cache(cache_path, counter)
+
+    # Pooled read-only connections: sqlite3 keeps the prepared statements
+    # of each connection, so repeated queries are not re-compiled.
+    own_pool = pool is None
+    if own_pool:
+        pool = dbpool.ConnectionPool(db_path, readers=workers)
+
+    def execute(item):
+        name, query = item
+        start = time.time()
+        key = cache_key(query, counter)
+        if key in cache:
+            rows, cached = cache[key], True
+        else:
+            with pool.reader() as db:
+                rows, cached = [list(row) for row in db.execute(query)], False
+        return {'name': name, 'query': query, 'rows': rows,
+                'latency': time.time() - start, 'cached': cached}
+
+    pending = [item for item in queries if cache_key(item[1], counter) not in cache]
+    if workers > 1 and len(pending) > 1:
+        threads = ThreadPool(workers)
+        try:
+            results = threads.map(execute, queries)
+        finally:
+            threads.close()
+            threads.join()
+    else:
+        results = [execute(item) for item in queries]
+
+    if own_pool:
+        pool.close()
+
+    if not all(r['cached'] for r in results):
+        for r in results:
+            cache[cache_key(r['query'], counter)] = r['rows']
+        # The cache is only an optimization: a failed write must not lose the report
+        try:
+            save_cache(cache_path, counter, cache)
+        except (IOError, OSError) as e:
+            print >> sys.stderr, "Report cache not saved: {0}".format(e)
+
+    return {'database': db_path,
+            'change_counter': counter,
+            'queries': results,
+            'latency': time.time() - started}
+
+
+if __name__ == '__main__':
+    report = run_report(sys.argv[1], workers=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    print json.dumps(report, indent=2)
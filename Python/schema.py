@@ -2,6 +2,17 @@
 # int() and float() type coercion functions. Otherwise it could easily stored as
 # as JSON or another serialized format.
 
+import calendar
+
+
+def epoch_seconds(timestamp):
+    '''Converts OSM ISO 8601 timestamp (ex: '2016-11-30T21:02:13Z') to integer epoch seconds.'''
+    if isinstance(timestamp, (int, long)):
+        return timestamp
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
 schema = {
     'node': {
         'type': 'dict',
@@ -11,9 +22,9 @@ schema = {
             'lon': {'required': True, 'type': 'float', 'coerce': float},
             'user': {'required': True, 'type': 'string'},
             'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
+            'version': {'required': True, 'type': 'integer', 'coerce': int},
             'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
+            'timestamp': {'required': True, 'type': 'integer', 'coerce': epoch_seconds}
         }
     },
     'node_tags': {
@@ -34,9 +45,9 @@ schema = {
             'id': {'required': True, 'type': 'integer', 'coerce': int},
             'user': {'required': True, 'type': 'string'},
             'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
+            'version': {'required': True, 'type': 'integer', 'coerce': int},
             'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
+            'timestamp': {'required': True, 'type': 'integer', 'coerce': epoch_seconds}
         }
     },
     'way_nodes': {
@@ -61,5 +72,17 @@ schema = {
                 'type': {'required': True, 'type': 'string', 'required': True}
             }
         }
+    },
+    'address': {
+        'type': 'dict',
+        'schema': {
+            'element_type': {'required': True, 'type': 'string'},
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'housenumber': {'required': True, 'type': 'string'},
+            'street': {'required': True, 'type': 'string'},
+            'postcode': {'required': True, 'type': 'string'},
+            'city': {'required': True, 'type': 'string'},
+            'state': {'required': True, 'type': 'string'}
+        }
     }
 }
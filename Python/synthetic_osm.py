@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Seeded synthetic OSM XML generator, to measure the pipeline without the
+424 MB Boston extract.
+
+Node/way proportions, tag frequencies and user skew follow the Boston sample
+(~86% nodes, ~12% of nodes tagged, top 10 users > 90% of edits). Address tags
+include the dirty street suffixes, postal codes and state entries handled by
+mapping, update_zip and update_state in data.py. The same seed and size
+always produce the same file.
+
+Usage: python synthetic_osm.py output.osm size_mb [seed]
+"""
+
+# Importing libraries
+import bisect
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+import data
+
+
+# Boston sample proportions
+NODE_RATIO = 0.86
+TAGGED_NODE_RATIO = 0.12
+ADDRESS_RATIO = 0.35
+
+STREET_NAMES = ["Main", "Washington", "Beacon", "Massachusetts", "Commonwealth", "Tremont",
+                "Boylston", "Harvard", "Elm", "Oak", "Summer", "Cambridge", "Centre", "Highland",
+                "Pleasant", "Maple", "School", "Union", "Prospect", "Adams", "Broadway", "Medford"]
+CITIES = ["Boston", "Cambridge", "Somerville", "Brookline", "Newton", "Quincy", "Medford",
+          "Malden", "Waltham", "Arlington", "Everett", "Chelsea", "Revere", "Watertown"]
+CLEAN_POSTCODES = ["02108", "02110", "02113", "02115", "02116", "02118", "02120", "02134",
+                   "02135", "02138", "02139", "02140", "02143", "02144", "02155", "01701"]
+DIRTY_POSTCODES = ["MA 02118", "Ma 02139", "02136-2460", "02115-3153", "02134 USA", "03079",
+                   "(617) 495-1000", "0213", "021320", "1742", "MA"]
+CLEAN_STATES = ["MA"]
+DIRTY_STATES = ["Ma", "ma", "Mass", "mass", "Massachusetts", "M", "MA.", "NY", "NH", "New York"]
+AMENITIES = [("parking", 166), ("bench", 138), ("school", 96), ("restaurant", 79),
+             ("parking_space", 57), ("place_of_worship", 56), ("library", 38), ("cafe", 33),
+             ("bicycle_parking", 32), ("fast_food", 26), ("bicycle_rental", 17), ("pub", 13),
+             ("university", 13), ("fire_station", 12), ("bar", 11), ("hospital", 11),
+             ("bank", 10), ("post_box", 10), ("fountain", 9), ("fuel", 9)]
+HIGHWAYS = ["residential", "service", "footway", "secondary", "tertiary", "primary", "cycleway"]
+SOURCES = ["massgis_import_v0.1_20071008165629", "Bing", "survey", "tiger_import_dch_v0.6_20070809"]
+USER_NAMES = [u"crschmidt", u"jremillard-massgis", u"OceanVortex", u"wambag", u"morganwahl",
+              u"ryebread", u"MassGIS Import", u"ingalls_imports", u"Ahlzen", u"mapper999",
+              u"Jérôme", u"Björn", u"François", u"Søren"]
+
+
+def weighted_choice(rng, choices, cumulative, total):
+    '''Returns a choice drawn from pre-computed cumulative weights.'''
+    return choices[min(bisect.bisect(cumulative, rng.random() * total), len(choices) - 1)]
+
+
+class OsmGenerator(object):
+    '''Generates synthetic OSM elements from a seeded random number generator.'''
+
+    def __init__(self, seed=0, users=700):
+        self.rng = random.Random(seed)
+        self.node_id = 30000000
+        self.way_id = 4000000
+        self.recent_nodes = []
+
+        # Zipf-like user activity: few users make most of the edits
+        self.users = [(i + 1, USER_NAMES[i] if i < len(USER_NAMES) else u"user{0}".format(i))
+                      for i in range(users)]
+        weights = [1.0 / (rank + 1) ** 1.8 for rank in range(users)]
+        self.user_cumulative = [sum(weights[:i + 1]) for i in range(users)]
+        self.user_total = self.user_cumulative[-1]
+
+        self.amenities = [name for name, _ in AMENITIES]
+        self.amenity_cumulative = [sum(count for _, count in AMENITIES[:i + 1]) for i in range(len(AMENITIES))]
+        self.amenity_total = self.amenity_cumulative[-1]
+
+        self.clean_suffixes = sorted(data.expected)
+        self.dirty_suffixes = sorted(data.mapping)
+
+    def attributes(self):
+        '''Returns the common user/version/changeset/timestamp attributes as an XML string.'''
+        rng = self.rng
+        uid, user = weighted_choice(rng, self.users, self.user_cumulative, self.user_total)
+        return u'user={0} uid="{1}" version="{2}" changeset="{3}" timestamp="{4:04d}-{5:02d}-{6:02d}T{7:02d}:{8:02d}:{9:02d}Z"'.format(
+            quoteattr(user), uid, min(int(rng.expovariate(0.7)) + 1, 40), rng.randint(100000, 44000000),
+            rng.randint(2008, 2016), rng.randint(1, 12), rng.randint(1, 28),
+            rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+
+    def street(self):
+        '''Returns a street name with a clean, abbreviated or numbered suffix.'''
+        rng = self.rng
+        name = rng.choice(STREET_NAMES)
+        x = rng.random()
+        if x < 0.65:
+            return u"{0} {1}".format(name, rng.choice(self.clean_suffixes))
+        elif x < 0.95:
+            return u"{0} {1}".format(name, rng.choice(self.dirty_suffixes))
+        elif x < 0.98:
+            return u"Route {0}".format(rng.randint(1, 140))
+        return u"{0} St #{1}".format(name, rng.randint(1, 20))
+
+    def address(self):
+        '''Returns addr:* tags as (key, value) pairs.'''
+        rng = self.rng
+        tags = [(u"addr:housenumber", unicode(rng.randint(1, 1500))),
+                (u"addr:street", self.street())]
+        if rng.random() < 0.7:
+            tags.append((u"addr:postcode", rng.choice(CLEAN_POSTCODES) if rng.random() < 0.85
+                         else rng.choice(DIRTY_POSTCODES)))
+        if rng.random() < 0.6:
+            tags.append((u"addr:city", rng.choice(CITIES)))
+        if rng.random() < 0.4:
+            tags.append((u"addr:state", rng.choice(CLEAN_STATES) if rng.random() < 0.8
+                         else rng.choice(DIRTY_STATES)))
+        return tags
+
+    def node_tags(self):
+        '''Returns the tags of a tagged node as (key, value) pairs.'''
+        rng = self.rng
+        tags = []
+        if rng.random() < 0.5:
+            tags.append((u"amenity", weighted_choice(rng, self.amenities, self.amenity_cumulative,
+                                                     self.amenity_total)))
+            tags.append((u"name", u"{0} {1}".format(rng.choice(STREET_NAMES), rng.choice(CITIES))))
+            if rng.random() < 0.05:
+                tags.append((u"wheelchair", rng.choice([u"yes", u"no", u"limited"])))
+        elif rng.random() < 0.5:
+            tags.append((u"highway", rng.choice([u"crossing", u"traffic_signals", u"stop", u"bus_stop"])))
+        else:
+            tags.append((u"source", rng.choice(SOURCES)))
+        if rng.random() < ADDRESS_RATIO:
+            tags.extend(self.address())
+        return tags
+
+    def way_tags(self):
+        '''Returns the tags of a way as (key, value) pairs.'''
+        rng = self.rng
+        if rng.random() < 0.55:
+            tags = [(u"building", u"yes"), (u"source", rng.choice(SOURCES))]
+            if rng.random() < ADDRESS_RATIO:
+                tags.extend(self.address())
+        else:
+            tags = [(u"highway", rng.choice(HIGHWAYS)), (u"name", self.street())]
+            if rng.random() < 0.3:
+                tags.append((u"tiger:county", u"Suffolk, MA"))
+        return tags
+
+    def node(self):
+        '''Returns a node element as an XML string.'''
+        rng = self.rng
+        self.node_id += rng.randint(1, 3)
+        self.recent_nodes.append(self.node_id)
+        if len(self.recent_nodes) > 5000:
+            del self.recent_nodes[:1000]
+        head = u' <node id="{0}" lat="{1:.7f}" lon="{2:.7f}" {3}'.format(
+            self.node_id, rng.uniform(42.2, 42.45), rng.uniform(-71.2, -70.95), self.attributes())
+        if rng.random() >= TAGGED_NODE_RATIO:
+            return head + u'/>\n'
+        return head + u'>\n' + format_tags(self.node_tags()) + u' </node>\n'
+
+    def way(self):
+        '''Returns a way element referencing recently generated nodes as an XML string.'''
+        rng = self.rng
+        self.way_id += rng.randint(1, 3)
+        start = rng.randint(0, max(len(self.recent_nodes) - 20, 0))
+        refs = self.recent_nodes[start:start + rng.randint(2, 15)]
+        return (u' <way id="{0}" {1}>\n'.format(self.way_id, self.attributes()) +
+                u''.join(u'  <nd ref="{0}"/>\n'.format(ref) for ref in refs) +
+                format_tags(self.way_tags()) + u' </way>\n')
+
+    def element(self):
+        '''Returns a node or a way following the Boston sample proportions.'''
+        if not self.recent_nodes or self.rng.random() < NODE_RATIO:
+            return self.node()
+        return self.way()
+
+
+def format_tags(tags):
+    '''Returns tag elements as an XML string.'''
+    return u''.join(u'  <tag k={0} v={1}/>\n'.format(quoteattr(k), quoteattr(v)) for k, v in tags)
+
+
+def generate(path, size_mb, seed=0):
+    '''Writes a synthetic OSM file of about size_mb megabytes and returns its element counts.'''
+    generator = OsmGenerator(seed)
+    limit = int(size_mb * 1024 * 1024)
+    counts = {'node': 0, 'way': 0}
+    with open(path, 'wb') as output:
+        output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        written = output.tell()
+        while written < limit:
+            chunk = generator.element().encode('utf-8')
+            output.write(chunk)
+            written += len(chunk)
+            counts['node' if chunk.startswith(b' <node') else 'way'] += 1
+        output.write(b'</osm>\n')
+    return counts
+
+
+if __name__ == '__main__':
+    print generate(sys.argv[1], float(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)